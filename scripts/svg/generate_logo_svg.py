@@ -1,7 +1,12 @@
 #!/usr/bin/env python3
 # Dependencies: none (stdlib only). For other SVG scripts, see scripts/svg/requirements.txt
 """Generate Sudobility logo as SVG."""
-import math
+import bisect
+import hashlib
+import sys
+from math import sin
+from functools import lru_cache
+from pathlib import Path
 
 SIZE = 1024
 CENTER = SIZE // 2
@@ -13,16 +18,23 @@ C_PURPLE = (168, 85, 247)
 C_CYAN   = (6, 182, 212)
 
 def lerp(c1, c2, t):
-    return tuple(int(c1[i] + (c2[i] - c1[i]) * max(0, min(1, t))) for i in range(3))
+    t = 0.0 if t < 0 else 1.0 if t > 1 else t
+    return (int(c1[0] + (c2[0] - c1[0]) * t),
+            int(c1[1] + (c2[1] - c1[1]) * t),
+            int(c1[2] + (c2[2] - c1[2]) * t))
 
+@lru_cache(maxsize=None)
+def stop_positions(stops):
+    return [s[0] for s in stops]
+
+@lru_cache(maxsize=None)
 def multi_gradient(t, stops):
     if t <= stops[0][0]: return stops[0][1]
     if t >= stops[-1][0]: return stops[-1][1]
-    for i in range(len(stops) - 1):
-        if stops[i][0] <= t <= stops[i+1][0]:
-            local_t = (t - stops[i][0]) / (stops[i+1][0] - stops[i][0])
-            return lerp(stops[i][1], stops[i+1][1], local_t)
-    return stops[-1][1]
+    i = bisect.bisect_right(stop_positions(stops), t) - 1
+    i = max(0, min(i, len(stops) - 2))
+    local_t = (t - stops[i][0]) / (stops[i+1][0] - stops[i][0])
+    return lerp(stops[i][1], stops[i+1][1], local_t)
 
 s_cells = [
     (1,0),(2,0),(3,0),
@@ -34,30 +46,74 @@ s_cells = [
 
 cell_size = 120
 gap = 16
-total_grid = 5 * cell_size + 4 * gap
-grid_x0 = CENTER - total_grid // 2
-grid_y0 = CENTER - total_grid // 2
 radius = 22
 
-stops = [(0.0,C_BLUE),(0.25,C_INDIGO),(0.5,C_VIOLET),(0.75,C_PURPLE),(1.0,C_CYAN)]
-y_min = min(r for _,r in s_cells)
-y_max = max(r for _,r in s_cells)
+# Tuple (hashable) so multi_gradient results are memoized across cells
+stops = ((0.0,C_BLUE),(0.25,C_INDIGO),(0.5,C_VIOLET),(0.75,C_PURPLE),(1.0,C_CYAN))
+
+
+def build_svg(s_cells, cell_size, gap, radius, stops):
+    """Render the S-grid to SVG bytes."""
+    total_grid = 5 * cell_size + 4 * gap
+    grid_x0 = CENTER - total_grid // 2
+    grid_y0 = CENTER - total_grid // 2
+
+    y_min = min(r for _,r in s_cells)
+    y_max = max(r for _,r in s_cells)
+
+    # Only a handful of distinct rows exist, so resolve each row's color once
+    inv_range = 1.0 / max(y_max - y_min, 1)
+    row_to_rgb = {row: multi_gradient((row - y_min) * inv_range, stops) for row in set(r for _,r in s_cells)}
+    rgba_prefix = {row: b"rgba(%d,%d,%d," % (r, g, b) for row, (r, g, b) in row_to_rgb.items()}
+
+    # Per-cell opacity shimmer depends only on the cell layout
+    opacity = [min((230 + int(25 * (0.5 + 0.5 * sin(c * 0.7 + r * 1.3)))) / 255.0, 1.0) for c, r in s_cells]
+
+    # Whole-sweep cell geometry as parallel columns (no per-cell tuple arithmetic)
+    pitch = cell_size + gap
+    xs = [grid_x0 + c * pitch for c, _ in s_cells]
+    ys = [grid_y0 + r * pitch for _, r in s_cells]
+
+    # Invariant rect attributes are baked into the template once; color and
+    # opacity share a single rgba() fill. The SVG is pure ASCII so it is built
+    # and written as bytes (no text-mode encode pass)
+    rect_tmpl = (b'  <rect x="%%d" y="%%d" width="%d" height="%d" rx="%d" ry="%d" '
+                 b'fill="%%s%%.3f)"/>\n' % (cell_size, cell_size, radius, radius))
+
+    buf = bytearray()
+    buf += b'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 %d %d" width="%d" height="%d">\n' % (SIZE, SIZE, SIZE, SIZE)
+
+    for i, (_, row) in enumerate(s_cells):
+        buf += rect_tmpl % (xs[i], ys[i], rgba_prefix[row], opacity[i])
+
+    buf += b'</svg>\n'
+    return bytes(buf)
 
-lines = [f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {SIZE} {SIZE}" width="{SIZE}" height="{SIZE}">']
 
-for col, row in s_cells:
-    x = grid_x0 + col * (cell_size + gap)
-    y = grid_y0 + row * (cell_size + gap)
-    t = (row - y_min) / max(y_max - y_min, 1)
-    color = multi_gradient(t, stops)
-    opacity = (230 + int(25 * (0.5 + 0.5 * math.sin(col * 0.7 + row * 1.3)))) / 255.0
-    opacity = min(opacity, 1.0)
-    r, g, b = color
-    lines.append(f'  <rect x="{x}" y="{y}" width="{cell_size}" height="{cell_size}" rx="{radius}" ry="{radius}" fill="rgb({r},{g},{b})" fill-opacity="{opacity:.3f}"/>')
+if __name__ == "__main__":
+    # Destination: first CLI argument, else public/logo.svg relative to the
+    # current directory (run from the app checkout). The directory must exist.
+    OUTPUT = Path(sys.argv[1] if len(sys.argv) > 1 else 'public/logo.svg')
+    if not OUTPUT.parent.is_dir():
+        sys.exit(f"Output directory not found: {OUTPUT.parent.resolve()} "
+                 "(pass the destination path or run from the app checkout)")
 
-lines.append('</svg>')
+    # Skip regeneration when the inputs match the last successful run. The
+    # script's own source is part of the key, so any code change (canvas
+    # size, markup, colors) invalidates it. Keys live next to this script,
+    # one per destination, so nothing is left beside the deployed SVG.
+    params = (s_cells, cell_size, gap, radius, stops)
+    hasher = hashlib.blake2b(Path(__file__).read_bytes())
+    hasher.update(repr((SIZE, CENTER, params)).encode())
+    key = hasher.hexdigest()
+    dest_id = hashlib.blake2b(str(OUTPUT.resolve()).encode(), digest_size=8).hexdigest()
+    key_path = Path(__file__).resolve().parent / '.cache' / f'logo-{dest_id}.cachekey'
+    if OUTPUT.exists() and key_path.exists() and key_path.read_text().strip() == key:
+        print(f"SVG up to date: {OUTPUT}")
+        sys.exit(0)
 
-with open('/Users/johnhuang/sudobility/public/logo.svg', 'w') as f:
-    f.write('\n'.join(lines) + '\n')
+    OUTPUT.write_bytes(build_svg(*params))
+    key_path.parent.mkdir(exist_ok=True)
+    key_path.write_text(key + '\n')
 
-print("SVG saved to public/logo.svg")
+    print(f"SVG saved to {OUTPUT}")
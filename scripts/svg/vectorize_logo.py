@@ -14,9 +14,27 @@ v3 — Full quality pipeline:
 9. Proper z-ordering and SVG optimization
 """
 
+import os
+
 import cv2
 import numpy as np
-from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from numba import njit
+    HAVE_NUMBA = True
+except ImportError:  # numba is optional; hot loops fall back to plain Python
+    HAVE_NUMBA = False
+
+    def njit(*args, **kwargs):
+        if args and callable(args[0]):
+            return args[0]
+        return lambda fn: fn
+
+try:
+    import cairosvg
+except (ImportError, OSError):  # cairosvg (or its libcairo) is optional; see render_svg
+    cairosvg = None
 
 INPUT = "/Users/johnhuang/sudojo/sudojo_app/public/logo.png"
 OUTPUT = "/Users/johnhuang/sudojo/sudojo_app/public/logo-2.svg"
@@ -39,30 +57,30 @@ def load_image(path):
 
 # ── Edge detection ─────────────────────────────────────────────
 
-def detect_edges(rgb):
+def detect_edges(rgb, lab):
     """Multi-channel Canny edge detection for facet boundaries."""
     gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
 
-    # Multi-scale on grayscale
-    e1 = cv2.Canny(gray, 30, 80)
-    e2 = cv2.Canny(gray, 60, 160)
-
-    # Per-channel edges (catches color-only boundaries)
-    er = cv2.Canny(rgb[:, :, 0], 35, 100)
-    eg = cv2.Canny(rgb[:, :, 1], 35, 100)
-    eb = cv2.Canny(rgb[:, :, 2], 35, 100)
+    jobs = [
+        # Multi-scale on grayscale
+        (gray, 30, 80),
+        (gray, 60, 160),
+        # Per-channel edges (catches color-only boundaries)
+        (rgb[:, :, 0], 35, 100),
+        (rgb[:, :, 1], 35, 100),
+        (rgb[:, :, 2], 35, 100),
+        # LAB edges (perceptually uniform)
+        (lab[:, :, 0], 30, 90),
+        (lab[:, :, 1], 25, 75),
+        (lab[:, :, 2], 25, 75),
+    ]
 
-    # LAB edges (perceptually uniform)
-    lab = cv2.cvtColor(rgb, cv2.COLOR_RGB2LAB)
-    el = cv2.Canny(lab[:, :, 0], 30, 90)
-    ea = cv2.Canny(lab[:, :, 1], 25, 75)
-    ebl = cv2.Canny(lab[:, :, 2], 25, 75)
+    # Canny releases the GIL, so the independent passes run concurrently;
+    # the union is then a single reduction over the stacked results
+    with ThreadPoolExecutor() as executor:
+        results = list(executor.map(lambda job: cv2.Canny(*job), jobs))
 
-    edges = np.maximum(e1, e2)
-    for e in [er, eg, eb, el, ea, ebl]:
-        edges = np.maximum(edges, e)
-
-    return edges
+    return np.stack(results).max(axis=0)
 
 
 # ── Superpixel segmentation ───────────────────────────────────
@@ -87,10 +105,11 @@ def slic_segmentation(rgb, alpha, edges, n_segments=1200):
 
     # Remap: background = -1, foreground = 0..N-1
     labels[~fg_mask] = -1
-    unique = sorted(set(labels.flat) - {-1})
-    remap = {old: new for new, old in enumerate(unique)}
-    remap[-1] = -1
-    out = np.vectorize(lambda x: remap.get(x, -1))(labels)
+    # Lookup table shifted by one so -1 (background) lands on index 0
+    unique = np.unique(labels[labels >= 0])
+    lut = np.full(int(labels.max()) + 2, -1, dtype=np.int32)
+    lut[unique + 1] = np.arange(len(unique), dtype=np.int32)
+    out = lut[labels + 1]
     n_labels = len(unique)
 
     print(f"  SLIC: {n_labels} superpixels")
@@ -100,111 +119,122 @@ def slic_segmentation(rgb, alpha, edges, n_segments=1200):
 # ── Adjacency computation ─────────────────────────────────────
 
 def compute_adjacency(labels, n_labels):
-    """Vectorized adjacency detection."""
-    adj = defaultdict(set)
-
-    # Horizontal neighbors
-    diff_h = labels[:, :-1] != labels[:, 1:]
-    ys, xs = np.where(diff_h)
-    for y, x in zip(ys, xs):
-        a, b = int(labels[y, x]), int(labels[y, x + 1])
-        if a >= 0 and b >= 0:
-            adj[a].add(b)
-            adj[b].add(a)
-
-    # Vertical neighbors
-    diff_v = labels[:-1, :] != labels[1:, :]
-    ys, xs = np.where(diff_v)
-    for y, x in zip(ys, xs):
-        a, b = int(labels[y, x]), int(labels[y + 1, x])
-        if a >= 0 and b >= 0:
-            adj[a].add(b)
-            adj[b].add(a)
-
-    return adj
+    """Vectorized adjacency detection.
 
+    Returns the symmetric neighbor graph in CSR form ``(indptr, indices)``:
+    the neighbors of label ``a`` are ``indices[indptr[a]:indptr[a + 1]]``.
+    """
+    # Horizontal and vertical neighbor pairs
+    la = np.concatenate([labels[:, :-1].ravel(), labels[:-1, :].ravel()])
+    lb = np.concatenate([labels[:, 1:].ravel(), labels[1:, :].ravel()])
+    keep = (la >= 0) & (lb >= 0) & (la != lb)
+    la, lb = la[keep], lb[keep]
 
-# ── Region statistics ──────────────────────────────────────────
+    # Pack unordered pairs into int64 keys and deduplicate
+    key = (np.minimum(la, lb).astype(np.int64) << 32) | np.maximum(la, lb).astype(np.int64)
+    pairs = np.unique(key)
+    a = (pairs >> 32).astype(np.int32)
+    b = (pairs & 0xffffffff).astype(np.int32)
 
-def compute_region_stats(labels, n_labels, rgb, alpha):
-    """Compute per-superpixel color stats in both RGB and LAB."""
-    lab = cv2.cvtColor(rgb, cv2.COLOR_RGB2LAB).astype(float)
+    # Symmetric CSR sorted by (src, dst)
+    src = np.concatenate([a, b])
+    dst = np.concatenate([b, a])
+    order = np.lexsort((dst, src))
+    indices = dst[order]
+    indptr = np.zeros(n_labels + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=n_labels), out=indptr[1:])
 
-    mean_rgb = np.zeros((n_labels, 3), dtype=float)
-    mean_lab = np.zeros((n_labels, 3), dtype=float)
-    mean_alpha = np.zeros(n_labels, dtype=float)
-    counts = np.zeros(n_labels, dtype=int)
-    brightness = np.zeros(n_labels, dtype=float)  # L channel
+    return indptr, indices
 
-    for lid in range(n_labels):
-        mask = labels == lid
-        count = mask.sum()
-        if count == 0:
-            continue
-        counts[lid] = count
-        mean_rgb[lid] = rgb[mask].mean(axis=0)
-        mean_lab[lid] = lab[mask].mean(axis=0)
-        mean_alpha[lid] = alpha[mask].mean()
-        brightness[lid] = mean_lab[lid, 0]
+
+# ── Region statistics ──────────────────────────────────────────
+
+def compute_region_stats(labels, n_labels, rgb, lab, alpha):
+    """Compute per-superpixel color stats in both RGB and LAB (uint8 LAB image)."""
+
+    # Single pass over all pixels: per-label sums via bincount instead of
+    # one full-image mask per label
+    lf = labels.ravel()
+    valid = lf >= 0
+    lf = lf[valid]
+    rgb_flat = rgb.reshape(-1, 3)[valid]
+    lab_flat = lab.reshape(-1, 3)[valid]
+
+    counts = np.bincount(lf, minlength=n_labels)
+    denom = np.maximum(counts, 1)
+
+    # Sums stay float64 (exact); the means are stored as float32, which is
+    # ample for 8-bit channels and halves traffic in the merge loop
+    mean_rgb = (np.column_stack([
+        np.bincount(lf, weights=rgb_flat[:, c], minlength=n_labels) for c in range(3)
+    ]) / denom[:, None]).astype(np.float32)
+    mean_lab = (np.column_stack([
+        np.bincount(lf, weights=lab_flat[:, c], minlength=n_labels) for c in range(3)
+    ]) / denom[:, None]).astype(np.float32)
+    mean_alpha = (np.bincount(lf, weights=alpha.ravel()[valid], minlength=n_labels)
+                  / denom).astype(np.float32)
+    brightness = mean_lab[:, 0].copy()  # L channel
 
     return mean_rgb, mean_lab, mean_alpha, counts, brightness
 
 
 # ── Merging ────────────────────────────────────────────────────
 
-def merge_regions(labels, n_labels, rgb, alpha, adj,
-                  mean_rgb, mean_lab, mean_alpha, counts, brightness,
-                  color_threshold=18.0, dark_threshold=40.0):
-    """
-    Merge adjacent superpixels with similar colors using LAB distance.
-    Dark/outline regions (low brightness) are merged more conservatively
-    to preserve the dark stroke lines between facets.
-    """
-    h, w = labels.shape
-
-    parent = list(range(n_labels))
-
-    def find(x):
-        while parent[x] != x:
-            parent[x] = parent[parent[x]]
-            x = parent[x]
-        return x
-
-    def union(a, b):
-        ra, rb = find(a), find(b)
-        if ra == rb:
-            return
-        if counts[ra] < counts[rb]:
-            ra, rb = rb, ra
-        parent[rb] = ra
-        total = counts[ra] + counts[rb]
-        if total > 0:
-            w_a, w_b = counts[ra] / total, counts[rb] / total
-            mean_rgb[ra] = mean_rgb[ra] * w_a + mean_rgb[rb] * w_b
-            mean_lab[ra] = mean_lab[ra] * w_a + mean_lab[rb] * w_b
-            mean_alpha[ra] = mean_alpha[ra] * w_a + mean_alpha[rb] * w_b
-            brightness[ra] = mean_lab[ra, 0]
-        counts[ra] = total
-
-    # Multiple passes until convergence
+@njit(cache=True)
+def _find(parent, x):
+    # Single-pass path halving
+    while parent[x] != x:
+        parent[x] = parent[parent[x]]
+        x = parent[x]
+    return x
+
+
+@njit(cache=True)
+def _union(parent, counts, mean_rgb, mean_lab, mean_alpha, brightness, a, b):
+    ra, rb = _find(parent, a), _find(parent, b)
+    if ra == rb:
+        return
+    if counts[ra] < counts[rb]:
+        ra, rb = rb, ra
+    parent[rb] = ra
+    total = counts[ra] + counts[rb]
+    if total > 0:
+        w_a, w_b = counts[ra] / total, counts[rb] / total
+        for c in range(3):
+            mean_rgb[ra, c] = mean_rgb[ra, c] * w_a + mean_rgb[rb, c] * w_b
+            mean_lab[ra, c] = mean_lab[ra, c] * w_a + mean_lab[rb, c] * w_b
+        mean_alpha[ra] = mean_alpha[ra] * w_a + mean_alpha[rb] * w_b
+        brightness[ra] = mean_lab[ra, 0]
+    counts[ra] = total
+
+
+@njit(cache=True)
+def _merge_until_stable(adj_indptr, adj_indices, parent, counts,
+                        mean_rgb, mean_lab, mean_alpha, brightness,
+                        color_threshold, dark_threshold):
+    """Run merge passes over the CSR adjacency until nothing changes."""
+    n_labels = parent.shape[0]
     changed = True
     passes = 0
     while changed:
         changed = False
         passes += 1
         for a in range(n_labels):
-            ra = find(a)
+            ra = _find(parent, a)
             if mean_alpha[ra] < 200 or counts[ra] == 0:
                 continue
-            for b in adj[a]:
-                rb = find(b)
+            for k in range(adj_indptr[a], adj_indptr[a + 1]):
+                rb = _find(parent, adj_indices[k])
                 if ra == rb:
                     continue
                 if mean_alpha[rb] < 200 or counts[rb] == 0:
                     continue
 
                 # LAB distance (perceptually uniform)
-                lab_dist = np.linalg.norm(mean_lab[ra] - mean_lab[rb])
+                dl = mean_lab[ra, 0] - mean_lab[rb, 0]
+                da = mean_lab[ra, 1] - mean_lab[rb, 1]
+                db = mean_lab[ra, 2] - mean_lab[rb, 2]
+                lab_dist = np.sqrt(dl * dl + da * da + db * db)
 
                 # Are both dark? (potential outline strokes)
                 both_dark = brightness[ra] < dark_threshold and brightness[rb] < dark_threshold
@@ -221,25 +251,49 @@ def merge_regions(labels, n_labels, rgb, alpha, adj,
                     threshold = color_threshold
 
                 if lab_dist < threshold:
-                    union(ra, rb)
+                    _union(parent, counts, mean_rgb, mean_lab, mean_alpha, brightness, ra, rb)
                     changed = True
+    return passes
 
-    # Relabel
-    new_labels = np.full_like(labels, -1)
-    label_map = {}
-    next_id = 0
-    for y in range(h):
-        for x in range(w):
-            lbl = labels[y, x]
-            if lbl < 0:
-                continue
-            root = find(lbl)
-            if counts[root] == 0 or mean_alpha[root] < 200:
-                continue
-            if root not in label_map:
-                label_map[root] = next_id
-                next_id += 1
-            new_labels[y, x] = label_map[root]
+
+def merge_regions(labels, n_labels, rgb, alpha, adj,
+                  mean_rgb, mean_lab, mean_alpha, counts, brightness,
+                  color_threshold=18.0, dark_threshold=40.0):
+    """
+    Merge adjacent superpixels with similar colors using LAB distance.
+    Dark/outline regions (low brightness) are merged more conservatively
+    to preserve the dark stroke lines between facets.
+    """
+    adj_indptr, adj_indices = adj
+
+    # Array-backed union-find; the convergence loop runs compiled
+    parent = np.arange(n_labels, dtype=np.int32)
+    passes = _merge_until_stable(adj_indptr, adj_indices, parent, counts,
+                                 mean_rgb, mean_lab, mean_alpha, brightness,
+                                 float(color_threshold), float(dark_threshold))
+
+    # Relabel: flatten the forest by pointer jumping, then gather through a
+    # root → new id lookup table (ids assigned in raster first-appearance order)
+    roots = parent.copy()
+    while True:
+        nxt = roots[roots]
+        if np.array_equal(nxt, roots):
+            break
+        roots = nxt
+    keep_root = (counts[roots] > 0) & (mean_alpha[roots] >= 200)
+
+    fg = labels >= 0
+    safe = np.where(fg, labels, 0)
+    keep = fg & keep_root[safe]
+    pixel_roots = roots[safe]
+
+    kept_roots, first_idx = np.unique(pixel_roots[keep], return_index=True)
+    ordered_roots = kept_roots[np.argsort(first_idx)]
+    next_id = len(ordered_roots)
+    lut = np.full(n_labels, -1, dtype=np.int32)
+    lut[ordered_roots] = np.arange(next_id, dtype=np.int32)
+    new_labels = np.where(keep, lut[pixel_roots], -1).astype(labels.dtype)
+    label_map = {int(root): nid for nid, root in enumerate(ordered_roots)}
 
     # Build color maps
     new_colors = {}
@@ -254,6 +308,70 @@ def merge_regions(labels, n_labels, rgb, alpha, adj,
     return new_labels, next_id, new_colors, new_alphas, new_lab_colors
 
 
+# ── Region pixel index ─────────────────────────────────────────
+
+def build_region_index(labels, n_regions):
+    """Index every region's pixels once, CSR style.
+
+    The flat pixel ids of region ``rid`` are ``order[indptr[rid]:indptr[rid + 1]]``
+    (in raster order), so per-region lookups cost O(area) instead of a full
+    ``labels == rid`` scan.
+    """
+    flat = labels.ravel()
+    order = np.argsort(flat, kind="stable")
+    indptr = np.searchsorted(flat[order], np.arange(n_regions + 1))
+    return order, indptr, labels.shape
+
+
+def region_pixels(region_index, rid):
+    """(ys, xs) of the pixels in region ``rid``."""
+    order, indptr, shape = region_index
+    return np.unravel_index(order[indptr[rid]:indptr[rid + 1]], shape)
+
+
+def region_area(region_index, rid):
+    _, indptr, _ = region_index
+    return int(indptr[rid + 1] - indptr[rid])
+
+
+def interior_depth(region_index):
+    """Per-pixel erosion depth within its own region.
+
+    ``depth >= k`` holds exactly for the pixels that survive k 3x3 erosions
+    of their region's mask (the image border does not erode, as in cv2.erode):
+    it is the chessboard distance to the nearest pixel with a differently
+    labelled 8-neighbour. One distance transform serves every region.
+    """
+    order, indptr, (h, w) = region_index
+    labels = np.full(h * w, -1, dtype=np.int32)
+    labels[order[indptr[0]:indptr[-1]]] = np.repeat(
+        np.arange(len(indptr) - 1, dtype=np.int32), np.diff(indptr))
+    labels = labels.reshape(h, w)
+
+    edge = np.zeros((h, w), dtype=bool)
+    d = labels[:, 1:] != labels[:, :-1]
+    edge[:, 1:] |= d
+    edge[:, :-1] |= d
+    d = labels[1:, :] != labels[:-1, :]
+    edge[1:, :] |= d
+    edge[:-1, :] |= d
+    d = labels[1:, 1:] != labels[:-1, :-1]
+    edge[1:, 1:] |= d
+    edge[:-1, :-1] |= d
+    d = labels[1:, :-1] != labels[:-1, 1:]
+    edge[1:, :-1] |= d
+    edge[:-1, 1:] |= d
+
+    return cv2.distanceTransform(np.where(edge, 0, 255).astype(np.uint8), cv2.DIST_C, 3)
+
+
+def crop_box(ys, xs, shape, pad):
+    """Bounding box (y0, y1, x0, x1) of the pixels, padded and clipped to shape."""
+    h, w = shape
+    return (max(int(ys.min()) - pad, 0), min(int(ys.max()) + pad + 1, h),
+            max(int(xs.min()) - pad, 0), min(int(xs.max()) + pad + 1, w))
+
+
 # ── Stroke/outline detection ───────────────────────────────────
 
 def detect_strokes(rgb, alpha, labels, dark_threshold=65):
@@ -342,67 +460,111 @@ def detect_strokes(rgb, alpha, labels, dark_threshold=65):
 
 # ── Contour smoothing ──────────────────────────────────────────
 
+_GAUSSIAN_KERNELS = {}
+
+
+def _gaussian_kernel(sigma):
+    """Normalized 1D Gaussian kernel (same 4σ truncation as scipy), cached by sigma."""
+    kernel = _GAUSSIAN_KERNELS.get(sigma)
+    if kernel is None:
+        radius = int(4.0 * sigma + 0.5)
+        x = np.arange(-radius, radius + 1, dtype=np.float64)
+        kernel = np.exp(-0.5 / (sigma * sigma) * x ** 2)
+        kernel = kernel / kernel.sum()
+        _GAUSSIAN_KERNELS[sigma] = kernel
+    return kernel
+
+
+@njit(cache=True, nogil=True)
+def _conv1d_wrap(xs, ys, kernel, out_x, out_y):
+    """Convolve both coordinate arrays with a periodic boundary in one pass.
+
+    The kernel is symmetric, so mirrored taps are summed before weighting
+    (outermost first, matching scipy's correlate1d accumulation order).
+    """
+    n = xs.shape[0]
+    radius = kernel.shape[0] // 2
+    for i in range(n):
+        sx = xs[i] * kernel[radius]
+        sy = ys[i] * kernel[radius]
+        for k in range(radius, 0, -1):
+            lo = (i - k) % n
+            hi = (i + k) % n
+            sx += (xs[lo] + xs[hi]) * kernel[radius - k]
+            sy += (ys[lo] + ys[hi]) * kernel[radius - k]
+        out_x[i] = sx
+        out_y[i] = sy
+
+
 def gaussian_smooth_contour(contour, sigma=1.5):
     """
     Smooth a closed contour using 1D Gaussian filtering on coordinates.
     Unlike Chaikin corner-cutting, this is approximately area-preserving
     and doesn't systematically shrink the polygon.
     """
-    from scipy.ndimage import gaussian_filter1d
-
     pts = contour.reshape(-1, 2).astype(float)
     n = len(pts)
     if n < 6:
         return contour
 
-    # Wrap-pad for periodic boundary (closed contour)
-    pad = min(n, max(3, int(3 * sigma)))
-    x = np.concatenate([pts[-pad:, 0], pts[:, 0], pts[:pad, 0]])
-    y = np.concatenate([pts[-pad:, 1], pts[:, 1], pts[:pad, 1]])
-
-    x_smooth = gaussian_filter1d(x, sigma=sigma)
-    y_smooth = gaussian_filter1d(y, sigma=sigma)
-
-    # Extract the non-padded portion
-    result = np.column_stack([
-        x_smooth[pad:pad + n],
-        y_smooth[pad:pad + n],
-    ])
+    # Periodic boundary (closed contour) handled inside the convolution,
+    # so no padded copies are needed
+    if HAVE_NUMBA:
+        result = np.empty((n, 2))
+        _conv1d_wrap(pts[:, 0], pts[:, 1], _gaussian_kernel(sigma), result[:, 0], result[:, 1])
+    else:
+        # Interpreted, the loop above is far slower than scipy's wrap mode
+        from scipy.ndimage import gaussian_filter1d
+        result = gaussian_filter1d(pts, sigma=sigma, axis=0, mode='wrap')
 
     return result.reshape(-1, 1, 2).astype(np.int32)
 
 
 # ── Polygon extraction ─────────────────────────────────────────
 
-def extract_polygons(labels, n_regions, colors, alphas, lab_colors,
+def extract_polygons(region_index, n_regions, colors, alphas, lab_colors,
                      rgb, alpha, min_area=12):
-    """Extract clean polygon contours with adaptive simplification."""
-    polygons = []
+    """Extract clean polygon contours with adaptive simplification.
 
-    for rid in range(n_regions):
-        mask = (labels == rid).astype(np.uint8) * 255
-        area = cv2.countNonZero(mask)
+    Regions are processed independently on a thread pool (the OpenCV and
+    numerical work releases the GIL); output order follows region id.
+    """
+    h, w = region_index[2]
+    close_kernel = np.ones((3, 3), np.uint8)
+    overlap_kernel = np.ones((2, 2), np.uint8)
+
+    def process_region(rid):
+        area = region_area(region_index, rid)
         if area < min_area:
-            continue
+            return None
 
         a = alphas.get(rid, 1.0)
         if a < 0.8:
-            continue
+            return None
+
+        # Work inside the region's bounding box; the margin keeps the
+        # morphology below from ever touching the crop edge
+        ys, xs = region_pixels(region_index, rid)
+        y0, y1, x0, x1 = crop_box(ys, xs, (h, w), pad=4)
+        mask = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+        mask[ys - y0, xs - x0] = 255
 
         # Close to fill tiny holes, dilate 1px for slight overlap
-        kernel = np.ones((3, 3), np.uint8)
-        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel, iterations=1)
-        mask = cv2.dilate(mask, np.ones((2, 2), np.uint8), iterations=1)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, close_kernel, iterations=1)
+        mask = cv2.dilate(mask, overlap_kernel, iterations=1)
 
         # Find contours
-        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_TC89_L1)
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_TC89_L1,
+                                       offset=(x0, y0))
         if not contours:
-            continue
+            return None
 
-        contour = max(contours, key=cv2.contourArea)
-        carea = cv2.contourArea(contour)
+        areas = [cv2.contourArea(c) for c in contours]
+        best = int(np.argmax(areas))
+        contour = contours[best]
+        carea = areas[best]
         if carea < min_area:
-            continue
+            return None
 
         # Step 1: simplify to remove pixel-level noise
         perimeter = cv2.arcLength(contour, True)
@@ -417,32 +579,38 @@ def extract_polygons(labels, n_regions, colors, alphas, lab_colors,
 
         approx = cv2.approxPolyDP(contour, epsilon, True)
         if len(approx) < 3:
-            continue
-
-        # Step 2: Get full contour for smooth filtering, then Gaussian smooth
-        full_contour, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
-        if full_contour:
-            full_c = max(full_contour, key=cv2.contourArea)
-            # Adaptive sigma: more smoothing for larger regions
-            sigma = 1.0 if carea < 100 else (1.5 if carea < 500 else 2.5)
-            smoothed = gaussian_smooth_contour(full_c, sigma=sigma)
-
-            # Re-simplify the smoothed contour
-            smooth_perim = cv2.arcLength(smoothed, True)
-            approx = cv2.approxPolyDP(smoothed, 0.005 * smooth_perim, True)
-            if len(approx) < 3:
-                continue
+            return None
+
+        # Step 2: Get full contour for smooth filtering, then Gaussian smooth.
+        # RETR_EXTERNAL yields the same outlines in the same order for either
+        # chain mode, so the largest one sits at the same index.
+        full_contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE,
+                                            offset=(x0, y0))
+        full_c = full_contours[best]
+        # Adaptive sigma: more smoothing for larger regions
+        sigma = 1.0 if carea < 100 else (1.5 if carea < 500 else 2.5)
+        smoothed = gaussian_smooth_contour(full_c, sigma=sigma)
+
+        # Re-simplify the smoothed contour
+        smooth_perim = cv2.arcLength(smoothed, True)
+        approx = cv2.approxPolyDP(smoothed, 0.005 * smooth_perim, True)
+        if len(approx) < 3:
+            return None
 
         # Sample actual color from original pixels inside the polygon
-        color, sampled_alpha = sample_color_from_original(rgb, alpha, mask)
+        color, sampled_alpha = sample_color_from_original(
+            rgb[y0:y1, x0:x1], alpha[y0:y1, x0:x1], mask)
 
         # Check for gradient — only use if it improves over solid fill
         gradient = None
         if carea > 50:
-            grad_candidate = fit_gradient(rgb, mask)
+            ys, xs = np.nonzero(mask)
+            ys += y0
+            xs += x0
+            grad_candidate = fit_gradient(rgb, ys, xs)
             if grad_candidate:
                 # Verify gradient improves MSE vs solid fill
-                gradient = verify_gradient_improvement(rgb, mask, color, grad_candidate)
+                gradient = verify_gradient_improvement(rgb, ys, xs, color, grad_candidate)
 
         points = approx.reshape(-1, 2).tolist()
 
@@ -454,7 +622,7 @@ def extract_polygons(labels, n_regions, colors, alphas, lab_colors,
         else:
             cx, cy = np.mean(points, axis=0)
 
-        polygons.append({
+        return {
             "points": points,
             "color": color,
             "opacity": round(min(sampled_alpha, 1.0), 3),
@@ -463,9 +631,55 @@ def extract_polygons(labels, n_regions, colors, alphas, lab_colors,
             "centroid": (cx, cy),
             "brightness": lab_colors.get(rid, np.array([50, 0, 0]))[0],
             "region_id": rid,
-        })
+        }
+
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        results = executor.map(process_region, range(n_regions))
+        return [poly for poly in results if poly is not None]
+
+
+@njit(cache=True, nogil=True)
+def _trimmed_mean_u8(colors, trim):
+    """Per-channel mean of the sorted ranks [trim, n - trim) of uint8 pixels.
 
-    return polygons
+    A 256-bin histogram per channel replaces sorting/selection entirely.
+    """
+    n = colors.shape[0]
+    lo, hi = trim, n - trim
+    out = np.empty(3, np.float64)
+    hist = np.empty(256, np.int64)
+    for c in range(3):
+        hist[:] = 0
+        for i in range(n):
+            hist[colors[i, c]] += 1
+        total = 0
+        rank = 0
+        for v in range(256):
+            cnt = hist[v]
+            if cnt == 0:
+                continue
+            # Overlap of this value's ranks [rank, rank + cnt) with [lo, hi)
+            a = max(rank, lo)
+            b = min(rank + cnt, hi)
+            if b > a:
+                total += (b - a) * v
+            rank += cnt
+            if rank >= hi:
+                break
+        out[c] = total / (hi - lo)
+    return out
+
+
+def trimmed_mean_color(colors):
+    """Robust fill color for (n, 3) pixels: 10%-trimmed mean, median when small."""
+    n = len(colors)
+    # The median is the trimmed mean of the middle one (odd n) or two ranks
+    trim = max(1, n // 10) if n > 20 else (n - 1) // 2
+    if HAVE_NUMBA:
+        return tuple(int(v) for v in _trimmed_mean_u8(colors, trim))
+    # One O(n) selection across all channels instead of sorting
+    middle = np.partition(colors, [trim, n - trim - 1], axis=0)[trim:n - trim]
+    return tuple(int(v) for v in middle.mean(axis=0))
 
 
 def sample_color_from_original(rgb, alpha, mask):
@@ -484,16 +698,7 @@ def sample_color_from_original(rgb, alpha, mask):
     alphas = alpha[ys, xs]
 
     # Use trimmed mean (exclude top/bottom 10%) for robustness
-    n = len(colors)
-    if n > 20:
-        trim = max(1, n // 10)
-        means = []
-        for ch in range(3):
-            sorted_ch = np.sort(colors[:, ch])
-            means.append(int(np.mean(sorted_ch[trim:-trim])))
-        color = tuple(means)
-    else:
-        color = tuple(int(v) for v in np.median(colors, axis=0))
+    color = trimmed_mean_color(colors)
 
     a = float(np.median(alphas)) / 255.0
     return color, a
@@ -501,9 +706,8 @@ def sample_color_from_original(rgb, alpha, mask):
 
 # ── Gradient fitting and validation ─────────────────────────────
 
-def verify_gradient_improvement(rgb, mask, solid_color, gradient):
+def verify_gradient_improvement(rgb, ys, xs, solid_color, gradient):
     """Only use gradient if it reduces mean color error vs solid fill."""
-    ys, xs = np.where(mask > 0)
     if len(ys) < 10:
         return None
 
@@ -513,37 +717,44 @@ def verify_gradient_improvement(rgb, mask, solid_color, gradient):
     solid = np.array(solid_color, dtype=float)
     mse_solid = np.mean(np.sum((actual - solid) ** 2, axis=1))
 
-    # MSE with gradient fill: interpolate gradient color per pixel
-    g = gradient
-    gx1, gy1 = g["x1"], g["y1"]
-    gx2, gy2 = g["x2"], g["y2"]
-    c_start = np.array(g["color_start"], dtype=float)
-    c_end = np.array(g["color_end"], dtype=float)
-
-    # Project each pixel onto the gradient axis
-    dx, dy = gx2 - gx1, gy2 - gy1
-    length_sq = dx * dx + dy * dy
-    if length_sq < 1:
-        return None
-
-    t = ((xs - gx1) * dx + (ys - gy1) * dy) / length_sq
-    t = np.clip(t, 0, 1)
-
-    # Interpolated gradient colors
-    grad_colors = c_start[None, :] + t[:, None] * (c_end - c_start)[None, :]
-    mse_gradient = np.mean(np.sum((actual - grad_colors) ** 2, axis=1))
+    # MSE with gradient fill. Fresh fits from fit_gradient carry it already;
+    # otherwise interpolate the gradient color per pixel
+    mse_gradient = gradient.get("mse")
+    if mse_gradient is None:
+        g = gradient
+        gx1, gy1 = g["x1"], g["y1"]
+        gx2, gy2 = g["x2"], g["y2"]
+        c_start = np.array(g["color_start"], dtype=float)
+        c_end = np.array(g["color_end"], dtype=float)
+
+        # Project each pixel onto the gradient axis
+        dx, dy = gx2 - gx1, gy2 - gy1
+        length_sq = dx * dx + dy * dy
+        if length_sq < 1:
+            return None
+
+        t = ((xs - gx1) * dx + (ys - gy1) * dy) / length_sq
+        t = np.clip(t, 0, 1)
+
+        # Interpolated gradient colors
+        grad_colors = c_start[None, :] + t[:, None] * (c_end - c_start)[None, :]
+        mse_gradient = np.mean(np.sum((actual - grad_colors) ** 2, axis=1))
 
     # Only use gradient if it's meaningfully better (>15% MSE reduction)
     if mse_gradient < mse_solid * 0.85:
         return gradient
     return None
 
-def fit_gradient(rgb, mask):
+# Unit vectors for the gradient angle search (0°..175° in 5° steps), shape (2, 36)
+_GRADIENT_ANGLES = np.radians(np.arange(0, 180, 5))
+_GRADIENT_DIRECTIONS = np.stack([np.cos(_GRADIENT_ANGLES), np.sin(_GRADIENT_ANGLES)])
+
+
+def fit_gradient(rgb, ys, xs):
     """
-    Fit a linear gradient to a region.
+    Fit a linear gradient to the region made of pixels (ys, xs).
     Returns gradient params only if R² is high enough (good fit).
     """
-    ys, xs = np.where(mask > 0)
     if len(ys) < 20:
         return None
 
@@ -556,116 +767,152 @@ def fit_gradient(rgb, mask):
     mean_coord = coords.mean(axis=0)
     dc = coords - mean_coord
 
-    best = None
-    best_r2 = 0
+    # Fine angle search: project onto all 36 directions at once
+    proj = dc @ _GRADIENT_DIRECTIONS  # (n, n_angles)
+    pmin = proj.min(axis=0)
+    span = proj.max(axis=0) - pmin
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = (proj - pmin) / span  # 0..1 along each gradient axis
+
+    # Fit linear model color = a + b*t for every (angle, channel) pair in
+    # closed form; R² checks fit quality. Flat channels (ss_tot < 1) are skipped.
+    y_mean = colors.mean(axis=0)
+    yc = colors - y_mean
+    ss_tot = (yc ** 2).sum(axis=0)  # (3,)
+    valid_ch = ss_tot >= 1
+    total_var = ss_tot[valid_ch].sum()
+    if total_var < 1:
+        return None
 
-    for angle_deg in range(0, 180, 5):  # Fine angle search
-        angle = np.radians(angle_deg)
-        direction = np.array([np.cos(angle), np.sin(angle)])
-        proj = dc @ direction
+    t_mean = t.mean(axis=0)
+    tc = t - t_mean
+    s_tt = (tc ** 2).sum(axis=0)  # (n_angles,)
+    s_ty = tc.T @ yc  # (n_angles, 3)
+    b = s_ty / (s_tt + 1e-10)[:, None]
+    a = y_mean - b * t_mean[:, None]
+
+    # Residual sum of squares of yc - b*tc, expanded
+    ss_res = ss_tot - 2 * b * s_ty + b ** 2 * s_tt[:, None]
+    residual_var = ss_res[:, valid_ch].sum(axis=1)
+    c_start = np.where(valid_ch, np.clip(a, 0, 255), 0)
+    c_end = np.where(valid_ch, np.clip(a + b, 0, 255), 0)
+
+    r2 = 1 - (residual_var / total_var)
+    color_range = np.linalg.norm(c_end - c_start, axis=1)
+
+    # Accept if gradient explains meaningful variance and is visually noticeable
+    ok = (span >= 6) & (r2 > 0.20) & (color_range > 15)
+    if not ok.any():
+        return None
+    k = int(np.argmax(np.where(ok, r2, -np.inf)))
+
+    direction = _GRADIENT_DIRECTIONS[:, k]
+    p_start = mean_coord - direction * span[k] / 2
+    p_end = mean_coord + direction * span[k] / 2
+    color_start = tuple(int(v) for v in c_start[k])
+    color_end = tuple(int(v) for v in c_end[k])
+
+    # Pixel-space MSE of the fill as rendered (integer stops, clamped t along
+    # the p_start → p_end axis), reusing this angle's projections
+    cs = np.array(color_start, dtype=float)
+    ce = np.array(color_end, dtype=float)
+    t_fill = np.clip(proj[:, k] / span[k] + 0.5, 0, 1)
+    fill = cs + t_fill[:, None] * (ce - cs)
+    mse = float(np.mean(np.sum((colors - fill) ** 2, axis=1)))
+
+    return {
+        "color_start": color_start,
+        "color_end": color_end,
+        "x1": float(p_start[0]),
+        "y1": float(p_start[1]),
+        "x2": float(p_end[0]),
+        "y2": float(p_end[1]),
+        "r2": float(r2[k]),
+        "mse": mse,
+    }
 
-        span = proj.max() - proj.min()
-        if span < 6:
-            continue
 
-        t = (proj - proj.min()) / span  # 0..1 along gradient axis
+# ── SVG rendering & quality metrics ────────────────────────────
 
-        # Fit linear model: color = a + b*t for each channel
-        # Compute R² to check fit quality
-        total_var = 0
-        residual_var = 0
-        c_start = np.zeros(3)
-        c_end = np.zeros(3)
+def render_svg(svg, width, height):
+    """Render SVG markup to numpy RGB + alpha arrays without touching disk.
 
-        for ch in range(3):
-            y = colors[:, ch]
-            y_mean = y.mean()
-            ss_tot = np.sum((y - y_mean) ** 2)
-            if ss_tot < 1:
-                continue
-
-            # Linear regression: y = a + b*t
-            t_mean = t.mean()
-            b = np.sum((t - t_mean) * (y - y_mean)) / (np.sum((t - t_mean) ** 2) + 1e-10)
-            a = y_mean - b * t_mean
+    Uses cairosvg in-process when available, otherwise pipes the markup
+    through rsvg-convert's stdin/stdout.
+    """
+    data = svg.encode() if isinstance(svg, str) else svg
+    if cairosvg is not None:
+        png = cairosvg.svg2png(bytestring=data, output_width=width, output_height=height)
+    else:
+        import subprocess
+        png = subprocess.run(
+            ["rsvg-convert", "-w", str(width), "-h", str(height)],
+            input=data, check=True, capture_output=True,
+        ).stdout
+    img = cv2.imdecode(np.frombuffer(png, np.uint8), cv2.IMREAD_UNCHANGED)
+    if img is None:
+        raise RuntimeError("Failed to decode rendered PNG")
+    # Convert BGR(A) to RGB(A)
+    if img.shape[2] == 4:
+        rendered_rgb = cv2.cvtColor(img[:, :, :3], cv2.COLOR_BGR2RGB)
+        rendered_alpha = img[:, :, 3]
+    else:
+        rendered_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        rendered_alpha = np.full(img.shape[:2], 255, dtype=np.uint8)
+    return rendered_rgb, rendered_alpha
 
-            predicted = a + b * t
-            ss_res = np.sum((y - predicted) ** 2)
 
-            total_var += ss_tot
-            residual_var += ss_res
-            c_start[ch] = np.clip(a, 0, 255)
-            c_end[ch] = np.clip(a + b, 0, 255)
+def fg_abs_diff(orig_fg, rendered, fg_mask):
+    """Per-channel |orig - rendered| over foreground pixels.
 
-        if total_var < 1:
-            continue
+    ``orig_fg`` is ``orig[fg_mask]`` as float32, gathered once by the caller;
+    float32 is exact for differences of 8-bit values.
+    """
+    return np.abs(orig_fg - rendered[fg_mask].astype(np.float32))
 
-        r2 = 1 - (residual_var / total_var)
-        color_range = np.linalg.norm(c_end - c_start)
 
-        # Accept if gradient explains meaningful variance and is visually noticeable
-        if r2 > best_r2 and r2 > 0.20 and color_range > 15:
-            p_start = mean_coord - direction * span / 2
-            p_end = mean_coord + direction * span / 2
-            best_r2 = r2
-            best = {
-                "color_start": tuple(int(v) for v in c_start),
-                "color_end": tuple(int(v) for v in c_end),
-                "x1": float(p_start[0]),
-                "y1": float(p_start[1]),
-                "x2": float(p_end[0]),
-                "y2": float(p_end[1]),
-                "r2": r2,
-            }
+def psnr_from_diff(diff):
+    """PSNR from foreground differences (squares are exact; sum in float64)."""
+    mse = np.mean(np.square(diff), dtype=np.float64)
+    if mse < 1e-10:
+        return 100.0
+    return 10 * np.log10(255.0 ** 2 / mse)
 
-    return best
 
+@njit(cache=True)
+def _within_counts(diff, thresholds):
+    """Pixels whose max channel difference is <= each threshold, in one pass."""
+    counts = np.zeros(thresholds.shape[0], np.int64)
+    for i in range(diff.shape[0]):
+        d = max(diff[i, 0], diff[i, 1], diff[i, 2])
+        for t in range(thresholds.shape[0]):
+            if d <= thresholds[t]:
+                counts[t] += 1
+    return counts
 
-# ── SVG rendering & quality metrics ────────────────────────────
 
-def render_svg_to_array(svg_path, width, height):
-    """Render SVG to numpy RGBA array via rsvg-convert."""
-    import subprocess, tempfile, os
-    tmp = tempfile.NamedTemporaryFile(suffix=".png", delete=False)
-    tmp.close()
-    try:
-        subprocess.run(
-            ["rsvg-convert", "-w", str(width), "-h", str(height),
-             "-o", tmp.name, svg_path],
-            check=True, capture_output=True,
-        )
-        img = cv2.imread(tmp.name, cv2.IMREAD_UNCHANGED)
-        if img is None:
-            raise RuntimeError(f"Failed to read rendered PNG {tmp.name}")
-        # Convert BGR(A) to RGB(A)
-        if img.shape[2] == 4:
-            rendered_rgb = cv2.cvtColor(img[:, :, :3], cv2.COLOR_BGR2RGB)
-            rendered_alpha = img[:, :, 3]
-        else:
-            rendered_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            rendered_alpha = np.full(img.shape[:2], 255, dtype=np.uint8)
-        return rendered_rgb, rendered_alpha
-    finally:
-        os.unlink(tmp.name)
+def within_percentages(diff, thresholds):
+    """Percent of foreground pixels within each RGB threshold (max over channels)."""
+    thresholds = np.asarray(thresholds, dtype=np.float32)
+    if HAVE_NUMBA:
+        counts = _within_counts(diff, thresholds)
+    else:
+        counts = (diff.max(axis=1)[:, None] <= thresholds).sum(axis=0)
+    return counts / len(diff) * 100
 
 
 def compute_psnr(orig, rendered, fg_mask):
     """Compute PSNR over foreground pixels."""
-    orig_fg = orig[fg_mask].astype(float)
-    rend_fg = rendered[fg_mask].astype(float)
-    mse = np.mean((orig_fg - rend_fg) ** 2)
-    if mse < 1e-10:
-        return 100.0
-    return 10 * np.log10(255.0 ** 2 / mse)
+    return psnr_from_diff(fg_abs_diff(orig[fg_mask].astype(np.float32), rendered, fg_mask))
 
 
-def compute_per_polygon_error(orig, rendered, labels, polygons):
+def compute_per_polygon_error(orig, rendered, region_index, polygons):
     """Compute per-polygon MSE and mean color difference using interior pixels only.
 
     Interior pixels (eroded mask) avoid contamination from overlapping polygon
     boundaries, giving more accurate per-polygon error signals.
     """
-    h, w = labels.shape
+    h, w = region_index[2]
 
     # Build region_id → polygon index map
     rid_to_idx = {}
@@ -677,24 +924,33 @@ def compute_per_polygon_error(orig, rendered, labels, polygons):
     errors = [None] * len(polygons)
     kernel = np.ones((3, 3), np.uint8)
 
-    for rid, idx in rid_to_idx.items():
-        full_mask = (labels == rid)
-        # Erode by 2px to get interior-only pixels (avoid overlap zone)
-        mask_u8 = full_mask.astype(np.uint8) * 255
-        eroded = cv2.erode(mask_u8, kernel, iterations=2)
-        interior = eroded > 0
-
-        # Fall back to full mask if erosion leaves too few pixels
-        if interior.sum() < 10:
-            interior = full_mask
+    # Scratch buffers shared by every polygon; mask_u8 is cleared after each use
+    mask_u8 = np.zeros((h, w), dtype=np.uint8)
+    eroded = np.empty_like(mask_u8)
 
-        n_pixels = int(interior.sum())
+    for rid, idx in rid_to_idx.items():
+        ys, xs = region_pixels(region_index, rid)
+        # Erode by 2px to get interior-only pixels (avoid overlap zone),
+        # working only on the region's bounding box
+        y0, y1, x0, x1 = crop_box(ys, xs, (h, w), pad=2)
+        mask_u8[ys, xs] = 255
+        cv2.erode(mask_u8[y0:y1, x0:x1], kernel, dst=eroded[y0:y1, x0:x1], iterations=2)
+        mask_u8[ys, xs] = 0
+        iys, ixs = np.nonzero(eroded[y0:y1, x0:x1])
+        iys += y0
+        ixs += x0
+
+        # Fall back to full region if erosion leaves too few pixels
+        if len(iys) < 10:
+            iys, ixs = ys, xs
+
+        n_pixels = len(iys)
         if n_pixels < 5:
             errors[idx] = {"mse": 0, "orig_mean": np.zeros(3), "rend_mean": np.zeros(3), "n_pixels": 0}
             continue
 
-        orig_px = orig[interior].astype(float)
-        rend_px = rendered[interior].astype(float)
+        orig_px = orig[iys, ixs].astype(float)
+        rend_px = rendered[iys, ixs].astype(float)
         diff = orig_px - rend_px
         mse = float(np.mean(np.sum(diff ** 2, axis=1)))
 
@@ -729,12 +985,7 @@ def adjust_solid_color(poly, error_stats, damping):
     changed = False
 
     # Adjust solid fill color
-    r, g, b = poly["color"]
-    new_color = (
-        int(np.clip(r + correction[0], 0, 255)),
-        int(np.clip(g + correction[1], 0, 255)),
-        int(np.clip(b + correction[2], 0, 255)),
-    )
+    new_color = tuple(np.clip(current + correction, 0, 255).astype(np.uint8).tolist())
     if new_color != poly["color"]:
         poly["color"] = new_color
         changed = True
@@ -744,17 +995,18 @@ def adjust_solid_color(poly, error_stats, damping):
     if grad:
         cs = grad["color_start"]
         ce = grad["color_end"]
-        new_cs = tuple(int(np.clip(cs[i] + correction[i], 0, 255)) for i in range(3))
-        new_ce = tuple(int(np.clip(ce[i] + correction[i], 0, 255)) for i in range(3))
+        ends = np.clip(np.array([cs, ce], dtype=float) + correction, 0, 255).astype(np.uint8)
+        new_cs, new_ce = tuple(ends[0].tolist()), tuple(ends[1].tolist())
         if new_cs != cs or new_ce != ce:
             grad["color_start"] = new_cs
             grad["color_end"] = new_ce
+            grad.pop("mse", None)  # Fit-time MSE no longer describes the fill
             changed = True
 
     return changed
 
 
-def try_upgrade_to_gradient(poly, error_stats, rgb, labels):
+def try_upgrade_to_gradient(poly, error_stats, rgb, region_index):
     """For solid polygons with high MSE, try upgrading to gradient."""
     if poly.get("gradient") is not None:
         return False
@@ -765,22 +1017,22 @@ def try_upgrade_to_gradient(poly, error_stats, rgb, labels):
     if rid is None:
         return False
 
-    mask = (labels == rid).astype(np.uint8) * 255
-    if cv2.countNonZero(mask) < 50:
+    ys, xs = region_pixels(region_index, rid)
+    if len(ys) < 50:
         return False
 
-    grad = fit_gradient(rgb, mask)
+    grad = fit_gradient(rgb, ys, xs)
     if grad is None:
         return False
 
-    grad = verify_gradient_improvement(rgb, mask, poly["color"], grad)
+    grad = verify_gradient_improvement(rgb, ys, xs, poly["color"], grad)
     if grad is not None:
         poly["gradient"] = grad
         return True
     return False
 
 
-def refit_gradient(poly, error_stats, rgb, labels):
+def refit_gradient(poly, error_stats, rgb, region_index):
     """For gradient polygons with high MSE, re-fit the gradient."""
     if poly.get("gradient") is None:
         return False
@@ -791,11 +1043,11 @@ def refit_gradient(poly, error_stats, rgb, labels):
     if rid is None:
         return False
 
-    mask = (labels == rid).astype(np.uint8) * 255
-    if cv2.countNonZero(mask) < 50:
+    ys, xs = region_pixels(region_index, rid)
+    if len(ys) < 50:
         return False
 
-    new_grad = fit_gradient(rgb, mask)
+    new_grad = fit_gradient(rgb, ys, xs)
     if new_grad is None:
         return False
 
@@ -811,14 +1063,14 @@ def refit_gradient(poly, error_stats, rgb, labels):
         "r2": new_grad["r2"],
     }
 
-    verified = verify_gradient_improvement(rgb, mask, poly["color"], blended)
+    verified = verify_gradient_improvement(rgb, ys, xs, poly["color"], blended)
     if verified is not None:
         poly["gradient"] = verified
         return True
     return False
 
 
-def split_high_error_polygon(poly, rgb, alpha, labels):
+def split_high_error_polygon(poly, rgb, alpha, region_index):
     """Split a high-error polygon into sub-polygons using k-means color clustering.
 
     Returns a list of new polygon dicts, or None if splitting doesn't help.
@@ -827,8 +1079,7 @@ def split_high_error_polygon(poly, rgb, alpha, labels):
     if rid is None:
         return None
 
-    mask = (labels == rid)
-    ys, xs = np.where(mask)
+    ys, xs = region_pixels(region_index, rid)
     n_pixels = len(ys)
     if n_pixels < 100:  # Too small to split
         return None
@@ -848,26 +1099,30 @@ def split_high_error_polygon(poly, rgb, alpha, labels):
     if color_dist < 15:  # Clusters too similar — don't split
         return None
 
-    h, w = labels.shape
+    h, w = region_index[2]
     new_polys = []
 
     for k in range(2):
-        sub_mask = np.zeros((h, w), dtype=np.uint8)
         sub_idx = cluster_labels == k
         sub_ys, sub_xs = ys[sub_idx], xs[sub_idx]
-        sub_mask[sub_ys, sub_xs] = 255
 
-        area = cv2.countNonZero(sub_mask)
+        area = len(sub_ys)
         if area < 30:
             continue
 
+        # Crop to the cluster's bounding box with room for the morphology
+        y0, y1, x0, x1 = crop_box(sub_ys, sub_xs, (h, w), pad=4)
+        sub_mask = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+        sub_mask[sub_ys - y0, sub_xs - x0] = 255
+
         # Morphological cleanup
         kernel = np.ones((3, 3), np.uint8)
         sub_mask = cv2.morphologyEx(sub_mask, cv2.MORPH_CLOSE, kernel, iterations=2)
         sub_mask = cv2.dilate(sub_mask, np.ones((2, 2), np.uint8), iterations=1)
 
         # Find contours
-        contours, _ = cv2.findContours(sub_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
+        contours, _ = cv2.findContours(sub_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE,
+                                       offset=(x0, y0))
         if not contours:
             continue
 
@@ -885,25 +1140,24 @@ def split_high_error_polygon(poly, rgb, alpha, labels):
             continue
 
         # Sample color
-        color, sampled_alpha = sample_color_from_original(rgb, alpha, sub_mask)
+        color, sampled_alpha = sample_color_from_original(
+            rgb[y0:y1, x0:x1], alpha[y0:y1, x0:x1], sub_mask)
 
         # Try gradient
         gradient = None
         if carea > 50:
-            grad = fit_gradient(rgb, sub_mask)
+            g_ys, g_xs = np.nonzero(sub_mask)
+            g_ys += y0
+            g_xs += x0
+            grad = fit_gradient(rgb, g_ys, g_xs)
             if grad:
-                gradient = verify_gradient_improvement(rgb, sub_mask, color, grad)
+                gradient = verify_gradient_improvement(rgb, g_ys, g_xs, color, grad)
 
         points = approx.reshape(-1, 2).tolist()
         M = cv2.moments(contour)
         cx = M["m10"] / M["m00"] if M["m00"] > 0 else np.mean([p[0] for p in points])
         cy = M["m01"] / M["m00"] if M["m00"] > 0 else np.mean([p[1] for p in points])
 
-        # Compute LAB brightness
-        lab_pixel = cv2.cvtColor(
-            np.array([[list(color)]], dtype=np.uint8), cv2.COLOR_RGB2LAB
-        )[0, 0]
-
         new_polys.append({
             "points": points,
             "color": color,
@@ -911,21 +1165,26 @@ def split_high_error_polygon(poly, rgb, alpha, labels):
             "area": carea,
             "gradient": gradient,
             "centroid": (cx, cy),
-            "brightness": float(lab_pixel[0]),
             "region_id": rid,  # Keep same region_id (both sub-polys share it)
         })
 
     if len(new_polys) >= 2:
+        # LAB brightness for all sub-polygons in one conversion
+        lab = cv2.cvtColor(
+            np.array([[p["color"] for p in new_polys]], dtype=np.uint8), cv2.COLOR_RGB2LAB
+        )[0]
+        for p, lab_pixel in zip(new_polys, lab):
+            p["brightness"] = float(lab_pixel[0])
         return new_polys
     return None
 
 
-def direct_optimize_colors(polygons, rgb, labels):
+def direct_optimize_colors(polygons, rgb, region_index):
     """One-shot color optimization: set each polygon's fill to the mean of
-    original pixels in its interior (using labels, not contour mask).
+    original pixels in its interior (using region pixels, not contour mask).
     No render needed — purely analytical. No oscillation.
     """
-    kernel = np.ones((3, 3), np.uint8)
+    depth = interior_depth(region_index)
     n_adjusted = 0
 
     for poly in polygons:
@@ -933,29 +1192,24 @@ def direct_optimize_colors(polygons, rgb, labels):
         if rid is None:
             continue
 
-        # Use labels mask, erode to get interior pixels
-        full_mask = (labels == rid).astype(np.uint8) * 255
-        eroded = cv2.erode(full_mask, kernel, iterations=3)
-        if cv2.countNonZero(eroded) < 10:
-            eroded = cv2.erode(full_mask, kernel, iterations=1)
-        if cv2.countNonZero(eroded) < 5:
-            eroded = full_mask
-
-        ys, xs = np.where(eroded > 0)
-        if len(ys) < 5:
+        rys, rxs = region_pixels(region_index, rid)
+        if len(rys) < 5:
             continue
 
-        # Optimal solid color = trimmed mean of original interior pixels
-        colors = rgb[ys, xs]
-        n = len(colors)
-        if n > 20:
-            trim = max(1, n // 10)
-            optimal = tuple(
-                int(np.mean(np.sort(colors[:, ch])[trim:-trim]))
-                for ch in range(3)
-            )
+        # Interior pixels: those surviving a 3px erosion (1px if that leaves
+        # too few, else the whole region), read off the shared depth map
+        rdepth = depth[rys, rxs]
+        inner = rdepth >= 3
+        if np.count_nonzero(inner) < 10:
+            inner = rdepth >= 1
+        if np.count_nonzero(inner) < 5:
+            ys, xs = rys, rxs
         else:
-            optimal = tuple(int(v) for v in np.median(colors, axis=0))
+            ys, xs = rys[inner], rxs[inner]
+
+        # Optimal solid color = trimmed mean of original interior pixels
+        n = len(ys)
+        optimal = trimmed_mean_color(rgb[ys, xs])
 
         if optimal != poly["color"]:
             poly["color"] = optimal
@@ -963,44 +1217,75 @@ def direct_optimize_colors(polygons, rgb, labels):
 
         # For gradient polygons, also re-fit gradient from interior pixels
         if poly.get("gradient") and n > 50:
-            inner_mask = np.zeros_like(full_mask)
-            inner_mask[ys, xs] = 255
-            new_grad = fit_gradient(rgb, inner_mask)
+            new_grad = fit_gradient(rgb, ys, xs)
             if new_grad:
-                verified = verify_gradient_improvement(rgb, inner_mask, optimal, new_grad)
+                verified = verify_gradient_improvement(rgb, ys, xs, optimal, new_grad)
                 if verified:
                     poly["gradient"] = verified
 
     return n_adjusted
 
 
-def adjust_stroke_widths(stroke_info, polygons, labels, orig_rgb, rendered_rgb, fg_mask):
+def precompute_stroke_geom(stroke_info, region_index, orig_rgb, fg_mask):
+    """Cache each stroke region's boundary ring and its original-side brightness.
+
+    Region geometry, the foreground mask and the original image are fixed for
+    the whole refinement, so this runs once per stroke; entries already
+    cached (``_bbox`` present) are skipped. ``_bbox`` is None when the ring
+    has too few foreground pixels to measure.
+    """
+    gray_orig = None
+    h, w = region_index[2]
+    kernel = np.ones((5, 5), np.uint8)
+
+    for rid, si in stroke_info.items():
+        if "_bbox" in si:
+            continue
+        si["_bbox"] = None
+
+        # Dilate inside the bounding box, padded for the 5x5 kernel's reach
+        ys, xs = region_pixels(region_index, rid)
+        if len(ys) == 0:
+            continue
+        y0, y1, x0, x1 = crop_box(ys, xs, (h, w), pad=2)
+        mask = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+        mask[ys - y0, xs - x0] = 255
+        dilated = cv2.dilate(mask, kernel, iterations=1)
+        boundary = (dilated - mask) > 0
+
+        bdy_u8 = (boundary & fg_mask[y0:y1, x0:x1]).view(np.uint8)
+        if cv2.countNonZero(bdy_u8) < 10:
+            continue
+
+        if gray_orig is None:
+            # uint8 is fine: cv2.mean accumulates in double
+            gray_orig = cv2.cvtColor(orig_rgb, cv2.COLOR_RGB2GRAY)
+        si["_bbox"] = (y0, y1, x0, x1)
+        si["_boundary_mask"] = bdy_u8
+        si["_orig_brightness"] = cv2.mean(gray_orig[y0:y1, x0:x1], mask=bdy_u8)[0]
+
+
+def adjust_stroke_widths(stroke_info, polygons, region_index, orig_rgb, rendered_rgb, fg_mask):
     """Nudge stroke widths based on boundary brightness comparison."""
-    gray_orig = cv2.cvtColor(orig_rgb, cv2.COLOR_RGB2GRAY).astype(float)
-    gray_rend = cv2.cvtColor(rendered_rgb, cv2.COLOR_RGB2GRAY).astype(float)
+    precompute_stroke_geom(stroke_info, region_index, orig_rgb, fg_mask)
+    gray_rend = cv2.cvtColor(rendered_rgb, cv2.COLOR_RGB2GRAY)
     adjusted = 0
 
     for poly in polygons:
         rid = poly.get("region_id")
         if rid is None or rid not in stroke_info:
             continue
-
-        mask = (labels == rid).astype(np.uint8) * 255
-        dilated = cv2.dilate(mask, np.ones((5, 5), np.uint8), iterations=1)
-        boundary = (dilated - mask) > 0
-
-        bdy_pixels = boundary & fg_mask
-        n = bdy_pixels.sum()
-        if n < 10:
+        si = stroke_info[rid]
+        if si["_bbox"] is None:
             continue
 
-        orig_bdy_brightness = gray_orig[bdy_pixels].mean()
-        rend_bdy_brightness = gray_rend[bdy_pixels].mean()
+        # Only the rendered side changes between iterations
+        y0, y1, x0, x1 = si["_bbox"]
+        rend_bdy_brightness = cv2.mean(gray_rend[y0:y1, x0:x1], mask=si["_boundary_mask"])[0]
 
         # If rendered boundary is brighter than original → stroke too thin
         # If rendered boundary is darker than original → stroke too thick
-        diff = orig_bdy_brightness - rend_bdy_brightness
-        si = stroke_info[rid]
+        diff = si["_orig_brightness"] - rend_bdy_brightness
         if abs(diff) > 3:
             nudge = np.clip(diff * 0.02, -0.15, 0.15)
             new_width = np.clip(si["width"] + nudge, 0.5, 4.0)
@@ -1012,13 +1297,16 @@ def adjust_stroke_widths(stroke_info, polygons, labels, orig_rgb, rendered_rgb,
 
 
 def _snapshot_state(polygons, stroke_info):
-    """Deep copy polygon colors/gradients and stroke widths for rollback."""
-    import copy
+    """Copy polygon colors/gradients and stroke widths for rollback.
+
+    Gradients are flat dicts of scalars and tuples, so a shallow copy suffices.
+    """
     poly_state = []
     for p in polygons:
+        g = p.get("gradient")
         poly_state.append({
             "color": p["color"],
-            "gradient": copy.deepcopy(p.get("gradient")),
+            "gradient": None if g is None else g.copy(),
         })
     stroke_state = {rid: {"width": si["width"]} for rid, si in stroke_info.items()}
     return poly_state, stroke_state
@@ -1034,7 +1322,7 @@ def _restore_state(polygons, stroke_info, poly_state, stroke_state):
             stroke_info[rid]["width"] = ss["width"]
 
 
-def iterative_refine(polygons, stroke_info, rgb, alpha, labels,
+def iterative_refine(polygons, stroke_info, rgb, alpha, region_index,
                      width, height, output_path, max_iterations=15):
     """Iteratively refine polygon colors/gradients by comparing rendered SVG to original.
 
@@ -1042,27 +1330,27 @@ def iterative_refine(polygons, stroke_info, rgb, alpha, labels,
     Phase 2: Color/gradient correction iterations (color refinement)
     """
     fg_mask = alpha > 200
+    # The original never changes: gather its foreground pixels once
+    orig_fg = rgb[fg_mask].astype(np.float32)
 
     print(f"\n{'='*60}")
     print("Starting iterative refinement...")
     print(f"{'='*60}")
 
     # ── Phase 0: Direct color optimization (analytical, no render needed) ──
-    n_optimized = direct_optimize_colors(polygons, rgb, labels)
+    n_optimized = direct_optimize_colors(polygons, rgb, region_index)
     print(f"\n  Direct optimization: {n_optimized} polygon colors updated")
 
     # ── Phase 1: Polygon splitting (one-time structural improvement) ──
     svg = polygons_to_svg(polygons, width, height, stroke_info=stroke_info)
-    with open(output_path, "w") as f:
-        f.write(svg)
-    rendered_rgb, _ = render_svg_to_array(output_path, width, height)
+    rendered_rgb, _ = render_svg(svg, width, height)
 
-    psnr = compute_psnr(rgb, rendered_rgb, fg_mask)
-    diff = np.abs(rgb[fg_mask].astype(float) - rendered_rgb[fg_mask].astype(float))
-    within_20 = (diff.max(axis=1) <= 20).mean() * 100
+    diff = fg_abs_diff(orig_fg, rendered_rgb, fg_mask)
+    psnr = psnr_from_diff(diff)
+    within_20 = within_percentages(diff, [20])[0]
     print(f"\n  Baseline: PSNR={psnr:.2f} dB, {within_20:.1f}% within 20 RGB")
 
-    errors = compute_per_polygon_error(rgb, rendered_rgb, labels, polygons)
+    errors = compute_per_polygon_error(rgb, rendered_rgb, region_index, polygons)
     indexed_errors = [(i, e) for i, e in enumerate(errors) if e is not None and e["n_pixels"] > 0]
     indexed_errors.sort(key=lambda x: -x[1]["mse"])
 
@@ -1071,7 +1359,7 @@ def iterative_refine(polygons, stroke_info, rgb, alpha, labels,
     for idx, err in indexed_errors:
         if err["mse"] < 500 or err["n_pixels"] < 80:
             continue
-        new_polys = split_high_error_polygon(polygons[idx], rgb, alpha, labels)
+        new_polys = split_high_error_polygon(polygons[idx], rgb, alpha, region_index)
         if new_polys:
             to_remove.append(idx)
             to_add.extend(new_polys)
@@ -1088,21 +1376,20 @@ def iterative_refine(polygons, stroke_info, rgb, alpha, labels,
     best_psnr = 0
     best_poly_state = None
     best_stroke_state = None
+    best_errors = None
     stale_count = 0
 
     for iteration in range(max_iterations):
-        # 1. Write SVG
+        # 1. Build SVG
         svg = polygons_to_svg(polygons, width, height, stroke_info=stroke_info)
-        with open(output_path, "w") as f:
-            f.write(svg)
 
-        # 2. Render to PNG
-        rendered_rgb, _ = render_svg_to_array(output_path, width, height)
+        # 2. Render in memory
+        rendered_rgb, _ = render_svg(svg, width, height)
 
         # 3. Compute PSNR
-        psnr = compute_psnr(rgb, rendered_rgb, fg_mask)
-        diff = np.abs(rgb[fg_mask].astype(float) - rendered_rgb[fg_mask].astype(float))
-        within_20 = (diff.max(axis=1) <= 20).mean() * 100
+        diff = fg_abs_diff(orig_fg, rendered_rgb, fg_mask)
+        psnr = psnr_from_diff(diff)
+        within_20 = within_percentages(diff, [20])[0]
 
         improvement = psnr - best_psnr if best_psnr > 0 else psnr
         print(f"\n  Iteration {iteration}: PSNR={psnr:.2f} dB "
@@ -1121,14 +1408,11 @@ def iterative_refine(polygons, stroke_info, rgb, alpha, labels,
             print(f"  No improvement for {stale_count} iterations — stopping")
             break
 
-        # 4. Per-polygon error (re-render from best if reverted)
-        if stale_count > 0:
-            svg = polygons_to_svg(polygons, width, height, stroke_info=stroke_info)
-            with open(output_path, "w") as f:
-                f.write(svg)
-            rendered_rgb, _ = render_svg_to_array(output_path, width, height)
-
-        errors = compute_per_polygon_error(rgb, rendered_rgb, labels, polygons)
+        # 4. Per-polygon error. After a revert the polygons are back in the
+        # best state, whose render and errors were taken when it was reached
+        if stale_count == 0:
+            best_errors = compute_per_polygon_error(rgb, rendered_rgb, region_index, polygons)
+        errors = best_errors
 
         # 5. Sort by MSE, process top candidates
         indexed_errors = [(i, e) for i, e in enumerate(errors) if e is not None and e["n_pixels"] > 0]
@@ -1144,7 +1428,7 @@ def iterative_refine(polygons, stroke_info, rgb, alpha, labels,
 
         for idx, err in candidates:
             poly = polygons[idx]
-            if try_upgrade_to_gradient(poly, err, rgb, labels):
+            if try_upgrade_to_gradient(poly, err, rgb, region_index):
                 n_grad_upgrade += 1
 
         print(f"  Adjustments: {n_grad_upgrade} grad upgrades")
@@ -1158,21 +1442,20 @@ def iterative_refine(polygons, stroke_info, rgb, alpha, labels,
         _restore_state(polygons, stroke_info, best_poly_state, best_stroke_state)
 
     svg = polygons_to_svg(polygons, width, height, stroke_info=stroke_info)
-    with open(output_path, "w") as f:
+    with open(output_path, "wb") as f:
         f.write(svg)
 
     # Final quality report
-    rendered_rgb, _ = render_svg_to_array(output_path, width, height)
-    final_psnr = compute_psnr(rgb, rendered_rgb, fg_mask)
-    diff = np.abs(rgb[fg_mask].astype(float) - rendered_rgb[fg_mask].astype(float))
-    max_ch_diff = diff.max(axis=1)
-    mean_diff = diff.mean()
+    rendered_rgb, _ = render_svg(svg, width, height)
+    diff = fg_abs_diff(orig_fg, rendered_rgb, fg_mask)
+    final_psnr = psnr_from_diff(diff)
+    mean_diff = diff.mean(dtype=np.float64)
 
     print(f"\n  Final quality:")
     print(f"    PSNR: {final_psnr:.2f} dB")
     print(f"    Mean pixel error: {mean_diff:.1f} RGB")
-    for threshold in [5, 10, 20, 40]:
-        pct = (max_ch_diff <= threshold).mean() * 100
+    thresholds = [5, 10, 20, 40]
+    for threshold, pct in zip(thresholds, within_percentages(diff, thresholds)):
         print(f"    Within {threshold:2d} RGB: {pct:.1f}%")
     print(f"{'='*60}\n")
 
@@ -1183,17 +1466,50 @@ def hex_color(r, g, b):
     return f"#{r:02x}{g:02x}{b:02x}"
 
 
+def polygon_points_str(poly):
+    """SVG points attribute for a polygon, formatted once and cached on it."""
+    points_str = poly.get("_points_str")
+    if points_str is None:
+        # Integer coords — no precision loss at 1024x1024
+        pts = np.rint(np.asarray(poly["points"], dtype=float)).astype(np.int64)
+        points_str = " ".join(map("{0},{1}".format, pts[:, 0].tolist(), pts[:, 1].tolist()))
+        poly["_points_str"] = points_str
+    return points_str
+
+
+def _cached_fragment(poly, slot, key, build):
+    """Return the polygon's encoded SVG line for slot, rebuilding only when key changes.
+
+    Points never change after extraction/splitting, so the key only needs the
+    attributes refinement can touch (color, gradient, opacity, stroke width).
+    """
+    cache = poly.setdefault("_svg_cache", {})
+    hit = cache.get(slot)
+    if hit is not None and hit[0] == key:
+        return hit[1]
+    fragment = (build() + "\n").encode()
+    cache[slot] = (key, fragment)
+    return fragment
+
+
 def polygons_to_svg(polygons, width, height, stroke_info=None):
-    """Generate compact SVG with sharp polygon edges (matches low-poly style)."""
-    lines = []
-    lines.append(f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {width} {height}"'
-                 f' width="{width}" height="{height}">')
+    """Generate compact SVG with sharp polygon edges (matches low-poly style).
+
+    Fragments are cached on each polygon, so across refinement iterations
+    only polygons whose fill or stroke changed are re-formatted.
+    """
+    # Assemble straight into one byte buffer (written to disk as-is)
+    buf = bytearray(
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {width} {height}"'
+        f' width="{width}" height="{height}">\n'.encode())
 
     # Z-order: larger & darker first (background), smaller & brighter on top
-    polygons_sorted = sorted(polygons, key=lambda p: (
-        -p["area"],
-        p["brightness"],
-    ))
+    # (only the two sort keys are gathered into arrays, straight from the dicts)
+    n = len(polygons)
+    areas = np.fromiter((p["area"] for p in polygons), dtype=np.float64, count=n)
+    brightnesses = np.fromiter((p["brightness"] for p in polygons), dtype=np.float64, count=n)
+    order = np.lexsort((brightnesses, -areas))
+    polygons_sorted = [polygons[i] for i in order.tolist()]
 
     # First pass: collect gradient defs using userSpaceOnUse (absolute pixel coords)
     grad_defs = []
@@ -1204,55 +1520,62 @@ def polygons_to_svg(polygons, width, height, stroke_info=None):
             continue
         poly["_grad_id"] = f"g{grad_id}"
 
-        # Absolute pixel coordinates — avoids bounding-box rounding issues
-        c1 = hex_color(*g["color_start"])
-        c2 = hex_color(*g["color_end"])
-
-        grad_defs.append(
-            f'    <linearGradient id="g{grad_id}" gradientUnits="userSpaceOnUse" '
-            f'x1="{g["x1"]:.1f}" y1="{g["y1"]:.1f}" '
-            f'x2="{g["x2"]:.1f}" y2="{g["y2"]:.1f}">'
-            f'<stop offset="0%" stop-color="{c1}"/>'
-            f'<stop offset="100%" stop-color="{c2}"/>'
-            f'</linearGradient>'
-        )
+        def build_grad(g=g, grad_id=grad_id):
+            # Absolute pixel coordinates — avoids bounding-box rounding issues
+            c1 = hex_color(*g["color_start"])
+            c2 = hex_color(*g["color_end"])
+            return (
+                f'    <linearGradient id="g{grad_id}" gradientUnits="userSpaceOnUse" '
+                f'x1="{g["x1"]:.1f}" y1="{g["y1"]:.1f}" '
+                f'x2="{g["x2"]:.1f}" y2="{g["y2"]:.1f}">'
+                f'<stop offset="0%" stop-color="{c1}"/>'
+                f'<stop offset="100%" stop-color="{c2}"/>'
+                f'</linearGradient>'
+            )
+
+        key = (grad_id, g["x1"], g["y1"], g["x2"], g["y2"],
+               tuple(g["color_start"]), tuple(g["color_end"]))
+        grad_defs.append(_cached_fragment(poly, "grad", key, build_grad))
         grad_id += 1
 
     if grad_defs:
-        lines.append("  <defs>")
-        lines.extend(grad_defs)
-        lines.append("  </defs>")
+        buf += b"  <defs>\n"
+        for grad_def in grad_defs:
+            buf += grad_def
+        buf += b"  </defs>\n"
 
     # Second pass: emit polygons with integer coordinates for compactness
     for poly in polygons_sorted:
-        pts = poly["points"]
         opacity = poly["opacity"]
         if opacity < 0.01:
             continue
 
-        # Integer coords — no precision loss at 1024x1024
-        points_str = " ".join(f"{int(round(x))},{int(round(y))}" for x, y in pts)
-        r, g, b = poly["color"]
-        fill_hex = hex_color(r, g, b)
+        def build_fill(poly=poly, opacity=opacity):
+            points_str = polygon_points_str(poly)
+            r, g, b = poly["color"]
+            fill_hex = hex_color(r, g, b)
 
-        has_grad = poly.get("_grad_id")
-        if has_grad:
-            fill_attr = f'url(#{poly["_grad_id"]})'
-        else:
-            fill_attr = fill_hex
+            has_grad = poly.get("_grad_id")
+            if has_grad:
+                fill_attr = f'url(#{poly["_grad_id"]})'
+            else:
+                fill_attr = fill_hex
 
-        opacity_attr = f' fill-opacity="{opacity}"' if opacity < 0.99 else ""
+            opacity_attr = f' fill-opacity="{opacity}"' if opacity < 0.99 else ""
 
-        # For gradient fills, use the gradient for stroke too (no color mismatch at edges)
-        # For solid fills, use matching solid stroke
-        stroke_attr = fill_attr if has_grad else fill_hex
+            # For gradient fills, use the gradient for stroke too (no color mismatch at edges)
+            # For solid fills, use matching solid stroke
+            stroke_attr = fill_attr if has_grad else fill_hex
+
+            # Gap-prevention stroke (thin, same color as fill)
+            return (
+                f'  <polygon points="{points_str}" fill="{fill_attr}" '
+                f'stroke="{stroke_attr}" stroke-width="0.8" '
+                f'stroke-linejoin="round"{opacity_attr}/>'
+            )
 
-        # Gap-prevention stroke (thin, same color as fill)
-        lines.append(
-            f'  <polygon points="{points_str}" fill="{fill_attr}" '
-            f'stroke="{stroke_attr}" stroke-width="0.8" '
-            f'stroke-linejoin="round"{opacity_attr}/>'
-        )
+        key = (poly["color"], opacity, poly.get("_grad_id"))
+        buf += _cached_fragment(poly, "fill", key, build_fill)
 
     # Second layer: dark outline strokes on top (drawn as polygon outlines)
     if stroke_info:
@@ -1261,21 +1584,24 @@ def polygons_to_svg(polygons, width, height, stroke_info=None):
             if rid is None or rid not in stroke_info:
                 continue
 
-            pts = poly["points"]
             si = stroke_info[rid]
-            points_str = " ".join(f"{int(round(x))},{int(round(y))}" for x, y in pts)
-            sr, sg, sb = si["color"]
-            s_hex = hex_color(sr, sg, sb)
-            sw = si["width"]
-
-            lines.append(
-                f'  <polygon points="{points_str}" fill="none" '
-                f'stroke="{s_hex}" stroke-width="{sw}" '
-                f'stroke-linejoin="round"/>'
-            )
 
-    lines.append("</svg>")
-    return "\n".join(lines) + "\n"
+            def build_stroke(poly=poly, si=si):
+                points_str = polygon_points_str(poly)
+                sr, sg, sb = si["color"]
+                s_hex = hex_color(sr, sg, sb)
+                sw = si["width"]
+                return (
+                    f'  <polygon points="{points_str}" fill="none" '
+                    f'stroke="{s_hex}" stroke-width="{sw}" '
+                    f'stroke-linejoin="round"/>'
+                )
+
+            key = (tuple(si["color"]), si["width"])
+            buf += _cached_fragment(poly, "stroke", key, build_stroke)
+
+    buf += b"</svg>\n"
+    return bytes(buf)
 
 
 # ── Main pipeline ──────────────────────────────────────────────
@@ -1285,9 +1611,10 @@ def main():
     rgb, alpha = load_image(INPUT)
     h, w = rgb.shape[:2]
     print(f"  Size: {w}x{h}")
+    lab = cv2.cvtColor(rgb, cv2.COLOR_RGB2LAB)
 
     print("Detecting edges...")
-    edges = detect_edges(rgb)
+    edges = detect_edges(rgb, lab)
     edge_count = cv2.countNonZero(edges)
     print(f"  {edge_count} edge pixels")
 
@@ -1296,7 +1623,7 @@ def main():
 
     print("Computing region statistics...")
     mean_rgb, mean_lab, mean_alpha, counts, brightness = \
-        compute_region_stats(labels, n_labels, rgb, alpha)
+        compute_region_stats(labels, n_labels, rgb, lab, alpha)
 
     print("Computing adjacency...")
     adj = compute_adjacency(labels, n_labels)
@@ -1308,8 +1635,10 @@ def main():
         color_threshold=13.0, dark_threshold=45.0,
     )
 
+    region_index = build_region_index(labels, n_regions)
+
     print("Extracting polygons...")
-    polygons = extract_polygons(labels, n_regions, colors, alphas, lab_colors,
+    polygons = extract_polygons(region_index, n_regions, colors, alphas, lab_colors,
                                 rgb, alpha)
     n_grad = sum(1 for p in polygons if p.get("gradient"))
     print(f"  {len(polygons)} polygons ({n_grad} gradients, "
@@ -1321,10 +1650,9 @@ def main():
     print("Generating initial SVG...")
     svg = polygons_to_svg(polygons, w, h, stroke_info=stroke_info)
 
-    with open(OUTPUT, "w") as f:
+    with open(OUTPUT, "wb") as f:
         f.write(svg)
 
-    import os
     size_kb = os.path.getsize(OUTPUT) / 1024
     png_kb = os.path.getsize(INPUT) / 1024
     print(f"\nInitial result: {OUTPUT}")
@@ -1334,7 +1662,7 @@ def main():
     print(f"  Ratio: {size_kb/png_kb:.1%}")
 
     # Iterative refinement: render → compare → adjust → repeat
-    iterative_refine(polygons, stroke_info, rgb, alpha, labels,
+    iterative_refine(polygons, stroke_info, rgb, alpha, region_index,
                      w, h, OUTPUT, max_iterations=10)
 
     size_kb = os.path.getsize(OUTPUT) / 1024
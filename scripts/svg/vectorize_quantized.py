@@ -12,13 +12,19 @@ This produces cleaner SVGs than superpixel-based approaches because each
 color layer is a simple binary trace with smooth contours.
 """
 
+import os
+
 import cv2
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 INPUT = "/Users/johnhuang/sudojo/sudojo_app/public/logo.png"
 OUTPUT = "/Users/johnhuang/sudojo/sudojo_app/public/logo-3.svg"
 
+# Palette colors covering fewer pixels than this are not traced at all
+MIN_LAYER_PIXELS = 10
+
 
 def load_image(path):
     img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
@@ -59,17 +65,24 @@ def quantize_colors(rgb, alpha, n_colors=48):
     return label_map, centers, counts
 
 
+def ring_path(pts):
+    """SVG subpath "Mx,yLx,y...Z" for an (n, 2) integer point array, built in one join."""
+    return "M" + "L".join(map("{0},{1}".format, pts[:, 0].tolist(), pts[:, 1].tolist())) + "Z"
+
+
 def trace_color_layer(mask, simplify_eps=0.003):
     """Trace a binary mask into compound SVG path data (with holes).
 
     Uses RETR_CCOMP to get outer contours and holes, combining them
     into compound paths with proper winding for SVG fill-rule="evenodd".
     """
-    # Morphological close to fill small gaps, then smooth edges
+    # Morphological close to fill small gaps, then smooth edges. All three
+    # passes share one scratch buffer (blur and threshold run in place).
     kernel = np.ones((3, 3), np.uint8)
-    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel, iterations=1)
-    blurred = cv2.GaussianBlur(mask, (3, 3), 0.6)
-    _, clean = cv2.threshold(blurred, 127, 255, cv2.THRESH_BINARY)
+    clean = np.empty_like(mask)
+    cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel, dst=clean, iterations=1)
+    cv2.GaussianBlur(clean, (3, 3), 0.6, dst=clean)
+    cv2.threshold(clean, 127, 255, cv2.THRESH_BINARY, dst=clean)
 
     contours, hierarchy = cv2.findContours(
         clean, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_NONE
@@ -105,11 +118,7 @@ def trace_color_layer(mask, simplify_eps=0.003):
             continue
 
         # Build path data starting with outer contour
-        pts = simplified.reshape(-1, 2)
-        d = f"M{pts[0][0]},{pts[0][1]}"
-        for p in pts[1:]:
-            d += f"L{p[0]},{p[1]}"
-        d += "Z"
+        parts = [ring_path(simplified.reshape(-1, 2))]
 
         # Add any child holes
         child = hierarchy[i][2]  # First child
@@ -120,15 +129,11 @@ def trace_color_layer(mask, simplify_eps=0.003):
                 h_perim = cv2.arcLength(hole_contour, True)
                 h_simplified = cv2.approxPolyDP(hole_contour, simplify_eps * h_perim, True)
                 if len(h_simplified) >= 3:
-                    h_pts = h_simplified.reshape(-1, 2)
-                    d += f"M{h_pts[0][0]},{h_pts[0][1]}"
-                    for p in h_pts[1:]:
-                        d += f"L{p[0]},{p[1]}"
-                    d += "Z"
+                    parts.append(ring_path(h_simplified.reshape(-1, 2)))
             child = hierarchy[child][0]  # Next sibling
 
         paths.append({
-            "d": d,
+            "d": "".join(parts),
             "area": area,
             "is_hole": False,
         })
@@ -143,29 +148,27 @@ def hex_color(r, g, b):
 
 
 def build_svg(layers, width, height):
-    """Build SVG from traced color layers."""
-    lines = []
-    lines.append(f'<svg xmlns="http://www.w3.org/2000/svg" '
-                 f'viewBox="0 0 {width} {height}" '
-                 f'width="{width}" height="{height}">')
+    """Build SVG bytes from traced color layers."""
+    buf = bytearray(f'<svg xmlns="http://www.w3.org/2000/svg" '
+                    f'viewBox="0 0 {width} {height}" '
+                    f'width="{width}" height="{height}">\n'.encode())
 
     total_paths = 0
     for layer in layers:
-        color = layer["color"]
-        fill = hex_color(*color)
+        fill = hex_color(*layer["color"]).encode()
+        # Everything after the path data is identical within a layer
+        tail = (b'" fill="' + fill + b'" fill-rule="evenodd" stroke="' + fill
+                + b'" stroke-width="0.3" stroke-linejoin="round"/>\n')
 
         for path_info in layer["paths"]:
-            lines.append(
-                f'  <path d="{path_info["d"]}" '
-                f'fill="{fill}" fill-rule="evenodd" '
-                f'stroke="{fill}" stroke-width="0.3" '
-                f'stroke-linejoin="round"/>'
-            )
+            buf += b'  <path d="'
+            buf += path_info["d"].encode()
+            buf += tail
             total_paths += 1
 
-    lines.append("</svg>")
+    buf += b"</svg>\n"
     print(f"  {total_paths} paths in SVG")
-    return "\n".join(lines) + "\n"
+    return bytes(buf)
 
 
 def compute_quality(rgb, alpha, svg_path, width, height):
@@ -216,32 +219,38 @@ def main():
     label_map, centers, counts = quantize_colors(rgb, alpha, n_colors=96)
 
     print("Tracing color layers...")
-    layers = []
 
-    for color_idx in range(len(centers)):
-        if counts[color_idx] < 10:
-            continue
+    # L* of every palette color (for z-ordering) in one conversion
+    center_l = cv2.cvtColor(centers.reshape(-1, 1, 3), cv2.COLOR_RGB2LAB)[:, 0, 0]
+
+    def process_color(color_idx):
+        if counts[color_idx] < MIN_LAYER_PIXELS:
+            return None
 
         color = tuple(int(c) for c in centers[color_idx])
         mask = (label_map == color_idx).astype(np.uint8) * 255
 
         paths = trace_color_layer(mask)
         if not paths:
-            continue
+            return None
 
-        # Compute brightness for z-ordering
-        lab = cv2.cvtColor(np.array([[list(color)]], dtype=np.uint8), cv2.COLOR_RGB2LAB)
-        brightness = float(lab[0, 0, 0])
+        brightness = float(center_l[color_idx])
 
         total_area = sum(p["area"] for p in paths if not p["is_hole"])
 
-        layers.append({
+        return {
             "color": color,
             "paths": paths,
             "brightness": brightness,
             "total_area": total_area,
             "pixel_count": int(counts[color_idx]),
-        })
+        }
+
+    # Colors are independent and OpenCV releases the GIL, so trace them on
+    # a thread pool; map keeps palette order for the stable sort below
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        layers = [layer for layer in executor.map(process_color, range(len(centers)))
+                  if layer is not None]
 
     # Z-order: large bright regions first (background fill),
     # then small/dark regions on top (details and outlines should be visible)
@@ -252,10 +261,9 @@ def main():
     print("Building SVG...")
     svg = build_svg(layers, w, h)
 
-    with open(OUTPUT, "w") as f:
+    with open(OUTPUT, "wb") as f:
         f.write(svg)
 
-    import os
     size_kb = os.path.getsize(OUTPUT) / 1024
     png_kb = os.path.getsize(INPUT) / 1024
     print(f"\nResult: {OUTPUT}")